@@ -1,15 +1,36 @@
-import pyvista
-import tetgen
-import numpy
-
-import logging
+import argparse
 import logging
+import pathlib
+
+from .batch import collect_inputs, format_summary, load_spec, run_batch
 
 logger= logging.getLogger()
 debug,info,warn = logger.debug,logger.info,logger.warn
 
 
+def main(argv=None):
+    parser=argparse.ArgumentParser(prog='python -m principalstresslines')
+    parser.add_argument('--log-level',default='INFO')
+    commands=parser.add_subparsers(dest='command',required=True)
+
+    batch=commands.add_parser('batch',help='Analyze a directory or glob of OBJ/VTK meshes.')
+    batch.add_argument('inputs',help='Directory or glob pattern of input meshes.')
+    batch.add_argument('--spec',required=True,help='JSON file with material and constraints.')
+    batch.add_argument('--output',default='output',help='Directory for results, finished files are skipped.')
+    batch.add_argument('--workers',type=int,default=None,help='Cores to schedule solves on, defaults to the available CPUs.')
+    batch.add_argument('--memory-budget-mb',type=int,default=None,help='Memory to schedule solves against, defaults to 80%% of the available memory.')
+
+    args=parser.parse_args(argv)
+    logger.setLevel(level=args.log_level.upper())
+
+    if args.command=='batch':
+        inputs=collect_inputs(args.inputs)
+        memory_bytes=args.memory_budget_mb*1024**2 if args.memory_budget_mb else None
+        summary=run_batch(inputs,load_spec(args.spec),pathlib.Path(args.output),args.workers,memory_bytes)
+        print(format_summary(summary))
+        return 1 if any(s['status']=='failed' for s in summary) else 0
+
+
 if __name__=='__main__':
     logging.basicConfig()
-    logger.setLevel(level=logging.DEBUG)
-
+    raise SystemExit(main())
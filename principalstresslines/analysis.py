@@ -9,6 +9,8 @@ from types import SimpleNamespace
 from typing import List,Tuple,Union
 from pydantic import BaseModel,validator,ValidationError,conlist,conint,root_validator,confloat,constr
 from .stress import compute_stress
+from .cache import AnalysisCache
+from .meshtools import boundary_faces,clean_mesh,cluster_decimate,cluster_mean,compact,polygons_to_triangles,solidify,triangles_to_faces
 
 from .model import AnalysisRequest,AnalysisResponse
 
@@ -117,45 +119,129 @@ def tetrahedralize(polydata:pyvista.PolyData)->Tuple[numpy.ndarray,numpy.ndarray
     return vertices.flatten(),tetrahedrons
 
 
-def analyze(request:AnalysisRequest):
-    extrusion_vec=[0,0,.1]
-    clip_plane_normal = extrusion_vec / numpy.linalg.norm(extrusion_vec)
+def surface_view(
+     vm_vertices:numpy.ndarray
+    ,vm_tetrahedrons:numpy.ndarray
+    ,displacement:numpy.ndarray
+    ,cauchy_stress:numpy.ndarray
+    ,cauchy_strain:numpy.ndarray
+    ,decimation_grid:int=None
+)->dict:
+    """
+    Reduce volume results to the exterior faces of the volume mesh, each
+    carrying the fields of its adjacent tetrahedron, optionally decimated
+    for preview. If decimation would leave no faces the full boundary is
+    returned.
+
+    Returns:
+        AnalysisResponse boundary_mesh_* fields
+    """
+    faces,cells=boundary_faces(vm_vertices,vm_tetrahedrons)
+    vertices,faces,used=compact(vm_vertices,faces)
+    displacement=displacement.reshape(-1,3)[used]
+    if decimation_grid is not None:
+        d_vertices,d_faces,vertex_map,kept=cluster_decimate(vertices,faces,decimation_grid)
+        if len(d_faces) > 0:
+            vertices,faces,cells=d_vertices,d_faces,cells[kept]
+            displacement=cluster_mean(displacement,vertex_map,len(vertices))
+        else:
+            warn(f"Decimation grid {decimation_grid} collapses every boundary face, returning the full boundary.")
+    principal_stresses = list(map(compute_principal_stresses,cauchy_stress.reshape((-1,6))[cells]))
+    return dict(
+        boundary_mesh_vertices=vertices.flatten().tolist()
+        ,boundary_mesh_faces=faces.flatten().tolist()
+        ,boundary_mesh_node_displacements=displacement.flatten().tolist()
+        ,boundary_mesh_face_cauchy_stress=cauchy_stress.reshape((-1,6))[cells].flatten().tolist()
+        ,boundary_mesh_face_cauchy_strain=cauchy_strain.reshape((-1,6))[cells].flatten().tolist()
+        ,boundary_mesh_face_principal_stress_vectors=numpy.array(principal_stresses).flatten().tolist()
+    )
+
+
+def prepare_analysis(request:AnalysisRequest)->SimpleNamespace:
+    """
+    Build the closed surface mesh and the volume mesh of a request.
+    """
+    solidify_thickness=.1
 
 
-    csm_vertex_list=numpy.array(request.vertices)
+    csm_vertex_list=numpy.array(request.vertices).reshape(-1,3)
     csm_face_list = numpy.array(request.faces,dtype=numpy.int32)
-    vm_face_stride=request.face_stride
 
-    pvmesh=pyvista.PolyData(
-        var_inp=csm_vertex_list
-        ,faces=csm_face_list
-        ,n_faces=int(len(csm_face_list)/vm_face_stride)
+    diagonal=numpy.linalg.norm(csm_vertex_list.max(axis=0)-csm_vertex_list.min(axis=0))
+    csm_vertex_list,csm_triangle_list,vertex_map,_,report=clean_mesh(
+        csm_vertex_list
+        ,polygons_to_triangles(csm_face_list,request.face_stride)
+        ,request.weld_tolerance*diagonal
     )
+    vm_face_stride=4
+    if report.welded_vertices or report.degenerate_faces or report.duplicate_faces:
+        info(f"Cleaned input mesh: {report}")
+
+    pvmesh=pyvista.PolyData(csm_vertex_list,faces=triangles_to_faces(csm_triangle_list))
     if not pvmesh.is_manifold:
         debug('Mesh is not manifold, attempting to make manifold')
-        pvmesh=pvmesh.extrude(extrusion_vec,capping=True) \
-            .clip_closed_surface(normal=clip_plane_normal,tolerance=.0001) \
-            .fill_holes(1000) \
-            .triangulate() \
-            .compute_normals(auto_orient_normals=True)
-        vm_face_stride=3
+        solid_vertices,solid_triangles=solidify(
+            csm_vertex_list
+            ,csm_triangle_list
+            ,solidify_thickness
+        )
+        pvmesh=pyvista.PolyData(solid_vertices,faces=triangles_to_faces(solid_triangles))
 
     vm_vertex_list,vm_tetrahedron_list = tetrahedralize(pvmesh)
+    return SimpleNamespace(
+        surface_mesh=pvmesh
+        ,surface_mesh_face_stride=vm_face_stride
+        ,surface_mesh_vertex_map=vertex_map
+        ,clean_report=report
+        ,volume_mesh_vertices=vm_vertex_list
+        ,volume_mesh_tetrahedrons=vm_tetrahedron_list
+    )
+
+
+def solve_analysis(request:AnalysisRequest,prepared:SimpleNamespace)->AnalysisResponse:
+    """
+    Solve a request on the meshes built by `prepare_analysis`.
+    """
+    pvmesh=prepared.surface_mesh
+    vm_face_stride=prepared.surface_mesh_face_stride
+    vm_vertex_list=prepared.volume_mesh_vertices
+    vm_tetrahedron_list=prepared.volume_mesh_tetrahedrons
     displacement,cauchy_stress,cauchy_strain=compute_stress(
         'target'
         ,vm_vertex_list
         ,vm_tetrahedron_list
         ,request
     )
-    displacement=displacement
-    cauchy_stress=cauchy_stress
-    cauchy_strain=cauchy_strain
+    if request.result_view == 'surface':
+        debug('Extracting surface result view')
+        # The boundary mesh stands in for the input surface, so neither the
+        # input surface nor the volume is sent
+        return AnalysisResponse(
+            surface_mesh_vertices=[]
+            ,surface_mesh_faces=[]
+            ,surface_mesh_face_stride=vm_face_stride
+            ,volume_mesh_vertices=[]
+            ,volume_mesh_tetrahedrons=[]
+            ,volume_mesh_node_displacements=[]
+            ,volume_mesh_node_cauchy_stress=[]
+            ,volume_mesh_node_cauchy_strain=[]
+            ,volume_mesh_node_principal_stress_vectors=[]
+            ,**surface_view(
+                vm_vertex_list
+                ,vm_tetrahedron_list
+                ,displacement
+                ,cauchy_stress
+                ,cauchy_strain
+                ,request.surface_decimation_grid
+            )
+        )
     principal_stresses = list(map(compute_principal_stresses,cauchy_stress.reshape((-1,6))))
     principal_stresses = numpy.array(principal_stresses).flatten().tolist()
     rc=AnalysisResponse(
-        surface_mesh_vertices=pvmesh.verts.flatten().tolist()
+        surface_mesh_vertices=pvmesh.points.flatten().tolist()
         ,surface_mesh_faces=pvmesh.faces.flatten().tolist()
         ,surface_mesh_face_stride=vm_face_stride
+        ,surface_mesh_vertex_map=prepared.surface_mesh_vertex_map.tolist()
         ,volume_mesh_vertices=vm_vertex_list.flatten().tolist()
         ,volume_mesh_tetrahedrons=vm_tetrahedron_list.flatten().tolist()
         ,volume_mesh_node_displacements=displacement.flatten().tolist()
@@ -164,3 +250,16 @@ def analyze(request:AnalysisRequest):
         ,volume_mesh_node_principal_stress_vectors=principal_stresses
     )
     return rc
+
+
+def analyze(request:AnalysisRequest)->AnalysisResponse:
+    return solve_analysis(request,prepare_analysis(request))
+
+
+default_cache=AnalysisCache()
+
+def analyze_cached(request:AnalysisRequest,cache:AnalysisCache=default_cache)->AnalysisResponse:
+    """
+    Analyze a request, reusing cached or in flight results for identical requests.
+    """
+    return cache.get_or_compute(request,analyze)
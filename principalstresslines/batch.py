@@ -0,0 +1,202 @@
+import glob
+import json
+import logging
+import os
+import pathlib
+import time
+import numpy
+import pyvista
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from functools import partial
+from types import SimpleNamespace
+from typing import List, Tuple
+
+from . import materials
+from .analysis import prepare_analysis, solve_analysis
+from .model import AnalysisRequest, AnalysisResponse
+from .scheduler import JobEstimate, ResourceScheduler, SchedulerJob, estimate_job, estimate_prepare
+
+logger= logging.getLogger()
+debug,info,warn = logger.debug,logger.info,logger.warn
+
+
+INPUT_SUFFIXES=('.obj','.vtk','.vtp','.stl','.ply')
+
+
+def collect_inputs(pattern:str)->List[pathlib.Path]:
+    """
+    Resolve a directory or glob pattern to the mesh files it contains.
+    """
+    path=pathlib.Path(pattern)
+    if path.is_dir():
+        files=path.iterdir()
+    else:
+        files=map(pathlib.Path,glob.glob(pattern))
+    return sorted(f for f in files if f.is_file() and f.suffix.lower() in INPUT_SUFFIXES)
+
+
+def load_spec(filename:str)->dict:
+    """
+    Load a batch spec. The spec holds every AnalysisRequest field except the
+    geometry, optionally `material` naming one from `materials` in place of
+    young_modulus/poisson_ratio, and `scale` applied to the input meshes.
+    """
+    with open(filename) as f:
+        return json.load(f)
+
+
+def request_from_file(filename:pathlib.Path,spec:dict)->AnalysisRequest:
+    polydata=pyvista.get_reader(str(filename)).read()
+    if not isinstance(polydata,pyvista.PolyData):
+        polydata=polydata.extract_surface()
+    polydata=polydata.triangulate()
+    spec=dict(spec)
+    scale=spec.pop('scale',None)
+    if scale is not None:
+        polydata.scale(scale,inplace=True)
+    material=spec.pop('material',None)
+    if material is not None:
+        material=getattr(materials,material)
+        spec.setdefault('young_modulus',material.young_modulus_mpa)
+        spec.setdefault('poisson_ratio',material.poisson_ratio)
+    return AnalysisRequest(
+        vertices=polydata.points.flatten().tolist()
+        ,face_stride=int(len(polydata.faces)/polydata.n_faces)
+        ,faces=polydata.faces.flatten().tolist()
+        ,**spec
+    )
+
+
+def output_stem(output_dir:pathlib.Path,filename:pathlib.Path)->pathlib.Path:
+    # Keep the suffix so part.obj and part.vtk do not share outputs
+    return output_dir.joinpath(filename.name)
+
+
+def is_finished(output_dir:pathlib.Path,filename:pathlib.Path)->bool:
+    # The arrays are written last, so they mark a completed analysis.
+    return pathlib.Path(f"{output_stem(output_dir,filename)}.npz").exists()
+
+
+def save_arrays(response:AnalysisResponse,stem:pathlib.Path):
+    """
+    Save every response field as a binary array, atomically.
+    """
+    arrays={k:numpy.asarray(v) for k,v in response.dict().items()}
+    tmp=f"{stem}.tmp.npz"
+    numpy.savez_compressed(tmp,**arrays)
+    os.replace(tmp,f"{stem}.npz")
+
+
+def prepare_file(filename:pathlib.Path,spec:dict)->Tuple[SimpleNamespace,JobEstimate,float]:
+    start=time.perf_counter()
+    prepared=prepare_analysis(request_from_file(filename,spec))
+    estimate=estimate_job(prepared.volume_mesh_vertices,prepared.volume_mesh_tetrahedrons)
+    return prepared,estimate,time.perf_counter()-start
+
+
+def solve_file(
+     filename:pathlib.Path
+    ,spec:dict
+    ,prepared:SimpleNamespace
+    ,output_dir:pathlib.Path
+)->Tuple[float,float]:
+    """
+    Solve and save a file on the meshes from `prepare_file`. The request is
+    re-read here rather than passed through the parent.
+    """
+    start=time.perf_counter()
+    response=solve_analysis(request_from_file(filename,spec),prepared)
+    solve_seconds=time.perf_counter()-start
+    stem=output_stem(output_dir,filename)
+    response.save(str(stem))
+    save_arrays(response,stem)
+    return solve_seconds,time.perf_counter()-start-solve_seconds
+
+
+def run_batch(
+     inputs:List[pathlib.Path]
+    ,spec:dict
+    ,output_dir:pathlib.Path
+    ,workers:int=None
+    ,memory_bytes:int=None
+)->List[dict]:
+    """
+    Analyze mesh files in parallel, writing each result as soon as it
+    completes. Files with existing results are skipped so an interrupted
+    batch can be restarted.
+
+    Every file is first prepared in a worker to estimate its solve, which is
+    scheduled on the prepared meshes as soon as the estimate returns.
+    Preparation and solves share the `workers` cores and `memory_bytes`
+    budget, and a file whose worker dies fails without stopping the batch.
+
+    Returns:
+        Per file summaries in input order
+    """
+    if output_dir.resolve() in {f.parent.resolve() for f in inputs}:
+        raise ValueError(f"Output directory {output_dir} must not contain input meshes.")
+    output_dir.mkdir(parents=True,exist_ok=True)
+    summary_file=output_dir.joinpath('summary.json')
+    previous={}
+    if summary_file.exists():
+        with open(summary_file) as f:
+            previous={s['file']:s for s in json.load(f)}
+    summary={
+        str(f):previous.get(str(f),{'file':str(f),'status':'skipped'})
+        for f in inputs if is_finished(output_dir,f)
+    }
+    pending=[f for f in inputs if str(f) not in summary]
+    info(f"{len(pending)} files to analyze, {len(summary)} already finished")
+    if not pending:
+        return _write_summary(summary_file,inputs,summary)
+
+    scheduler=ResourceScheduler(cores=workers,memory_bytes=memory_bytes)
+    jobs=[SchedulerJob(f,estimate_prepare(f.stat().st_size),prepare_file,(f,spec)) for f in pending]
+    for job,future in scheduler.run(partial(ProcessPoolExecutor,max_workers=scheduler.cores),jobs):
+        filename=job.key
+        result=summary.setdefault(str(filename),{'file':str(filename)})
+        try:
+            if job.func is prepare_file:
+                prepared,estimate,prepare_seconds=future.result()
+                result.update(
+                     status='prepared'
+                    ,tetrahedrons=estimate.tetrahedrons
+                    ,dofs=estimate.dofs
+                    ,estimated_memory_bytes=estimate.memory_bytes
+                    ,threads=scheduler.threads_for(estimate)
+                    ,prepare_seconds=prepare_seconds
+                    ,clean=asdict(prepared.clean_report)
+                )
+                scheduler.add(SchedulerJob(filename,estimate,solve_file,(filename,spec,prepared,output_dir)))
+                continue
+            result['solve_seconds'],result['save_seconds']=future.result()
+            result['status']='done'
+            result['total_seconds']=result['prepare_seconds']+result['solve_seconds']+result['save_seconds']
+            info(f"{filename}: {result['tetrahedrons']} tetrahedrons in {result['total_seconds']:.2f}s")
+        except Exception as e:
+            warn(f"{filename}: failed, {e!r}")
+            result.update(status='failed',error=repr(e))
+        _write_summary(summary_file,inputs,summary)
+
+    return _write_summary(summary_file,inputs,summary)
+
+
+def _write_summary(summary_file:pathlib.Path,inputs:List[pathlib.Path],summary:dict)->List[dict]:
+    summary=[summary[str(f)] for f in inputs if str(f) in summary]
+    with open(summary_file,'w') as f:
+        json.dump(summary,f,indent=2)
+    return summary
+
+
+def format_summary(summary:List[dict])->str:
+    lines=[f"{'file':<40} {'status':<8} {'tets':>8} {'dofs':>8} {'threads':>7} {'prep s':>8} {'solve s':>8} {'total s':>8}"]
+    for s in summary:
+        if s['status']=='done':
+            lines.append(
+                f"{pathlib.Path(s['file']).name:<40} {s['status']:<8} {s['tetrahedrons']:>8} {s['dofs']:>8} {s['threads']:>7}"
+                f" {s['prepare_seconds']:>8.2f} {s['solve_seconds']:>8.2f} {s['total_seconds']:>8.2f}"
+            )
+        else:
+            lines.append(f"{pathlib.Path(s['file']).name:<40} {s['status']:<8}")
+    return '\n'.join(lines)
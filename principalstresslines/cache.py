@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import threading
+import numpy
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable
+
+from .model import AnalysisRequest, AnalysisResponse
+
+logger= logging.getLogger()
+debug,info,warn = logger.debug,logger.info,logger.warn
+
+
+
+def _normalized_constraints(constraints:Iterable)->list:
+    # Regions within a constraint are unioned and constraints of one kind are
+    # summed, so neither order affects the solution.
+    normalized=[]
+    for constraint in constraints:
+        c=constraint.dict()
+        c['regions']=sorted(json.dumps(r,sort_keys=True) for r in c['regions'])
+        normalized.append(json.dumps(c,sort_keys=True))
+    return sorted(normalized)
+
+
+def request_hash(request:AnalysisRequest)->str:
+    """
+    Compute a canonical hash of a validated analysis request.
+
+    Geometry is hashed as binary buffers, constraints are hashed independent of
+    their ordering.
+    """
+    vertices=numpy.asarray(request.vertices,dtype=numpy.float64)
+    faces=numpy.asarray(request.faces,dtype=numpy.int64)
+    h=hashlib.sha256()
+    h.update(json.dumps([len(vertices),len(faces),request.face_stride]).encode())
+    h.update(vertices.tobytes())
+    h.update(faces.tobytes())
+    # Every other field is hashed as is, so new request fields are keyed too
+    fields=request.dict(exclude={'vertices','faces','load_constraints','fixed_constraints'})
+    fields['fixed_constraints']=_normalized_constraints(request.get_fixed_constraints())
+    fields['load_constraints']=_normalized_constraints(request.get_load_constraints())
+    h.update(json.dumps(fields,sort_keys=True).encode())
+    return h.hexdigest()
+
+
+# A float or int in a python list costs an 8 byte pointer plus a 24 byte object
+BYTES_PER_LIST_ITEM=32
+
+def response_size(response:AnalysisResponse)->int:
+    """
+    Estimate the resident size of a response in bytes from its list fields.
+    """
+    return BYTES_PER_LIST_ITEM*sum(len(v) for v in response.__dict__.values() if isinstance(v,list))
+
+
+class AnalysisCache:
+    """
+    LRU cache of analysis responses keyed by `request_hash`, bounded by the
+    estimated size of the cached responses. Responses larger than the whole
+    bound are returned but not cached.
+
+    Identical requests arriving while a solve is in flight wait on that solve
+    instead of starting their own. Cached responses are shared between callers
+    and must be treated as read-only.
+    """
+    def __init__(
+        self
+        ,max_bytes:int=256*1024**2
+        ,sizeof:Callable[[AnalysisResponse],int]=response_size
+    ):
+        assert max_bytes > 0,'max_bytes must be positive.'
+        self.max_bytes=max_bytes
+        self.sizeof=sizeof
+        self.size_bytes=0
+        self.hits=0
+        self.misses=0
+        self.coalesced=0
+        self._entries:OrderedDict=OrderedDict()
+        self._inflight:Dict[str,Future]={}
+        self._lock=threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes=0
+
+    def get_or_compute(
+        self
+        ,request:AnalysisRequest
+        ,compute:Callable[[AnalysisRequest],AnalysisResponse]
+    )->AnalysisResponse:
+        key=request_hash(request)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits+=1
+                debug(f"analysis cache hit {key[:12]}")
+                return self._entries[key][0]
+            future=self._inflight.get(key)
+            is_owner=future is None
+            if is_owner:
+                future=Future()
+                self._inflight[key]=future
+                self.misses+=1
+            else:
+                self.coalesced+=1
+
+        if not is_owner:
+            debug(f"analysis {key[:12]} in flight, waiting")
+            return future.result()
+
+        try:
+            result=compute(request)
+            size=self.sizeof(result)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            if size <= self.max_bytes:
+                self._entries[key]=(result,size)
+                self.size_bytes+=size
+                while self.size_bytes > self.max_bytes:
+                    evicted,(_,evicted_size)=self._entries.popitem(last=False)
+                    self.size_bytes-=evicted_size
+                    debug(f"analysis cache evicted {evicted[:12]}")
+            else:
+                debug(f"analysis {key[:12]} of {size} bytes exceeds the cache size, not cached")
+            del self._inflight[key]
+        future.set_result(result)
+        return result
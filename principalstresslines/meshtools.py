@@ -0,0 +1,244 @@
+import numpy
+import logging
+from dataclasses import dataclass
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import KDTree
+from typing import Tuple
+
+logger= logging.getLogger()
+debug,info,warn = logger.debug,logger.info,logger.warn
+
+
+
+def polygons_to_triangles(faces:numpy.ndarray,face_stride:int)->numpy.ndarray:
+    """
+    Fan triangulate a padded (pyvista style) face list of fixed stride.
+
+    Returns:
+        (n,3) triangle vertex indices
+    """
+    polygons=numpy.asarray(faces,dtype=numpy.int64).reshape(-1,face_stride)[:,1:]
+    corner_cn=polygons.shape[1]
+    if corner_cn < 3:
+        return numpy.empty((0,3),dtype=numpy.int64)
+    fans=[polygons[:,[0,i,i+1]] for i in range(1,corner_cn-1)]
+    return numpy.stack(fans,axis=1).reshape(-1,3)
+
+
+def triangles_to_faces(triangles:numpy.ndarray)->numpy.ndarray:
+    """
+    Convert (n,3) triangle indices to a padded (pyvista style) face list.
+    """
+    triangles=numpy.asarray(triangles).reshape(-1,3)
+    return numpy.hstack([numpy.full((len(triangles),1),3,dtype=triangles.dtype),triangles]).flatten()
+
+
+def vertex_normals(vertices:numpy.ndarray,triangles:numpy.ndarray)->numpy.ndarray:
+    """
+    Area weighted unit vertex normals. Unreferenced vertices get a zero normal.
+    """
+    v=vertices[triangles]
+    face_normals=numpy.cross(v[:,1]-v[:,0],v[:,2]-v[:,0])
+    normals=numpy.zeros_like(vertices,dtype=numpy.float64)
+    for corner in range(3):
+        numpy.add.at(normals,triangles[:,corner],face_normals)
+    lengths=numpy.linalg.norm(normals,axis=1)
+    lengths[lengths==0]=1.0
+    return normals/lengths[:,None]
+
+
+def boundary_edges(triangles:numpy.ndarray)->numpy.ndarray:
+    """
+    Directed edges used by exactly one triangle, oriented as in that triangle.
+    """
+    edges=triangles[:,[0,1,1,2,2,0]].reshape(-1,2)
+    _,inverse,counts=numpy.unique(numpy.sort(edges,axis=1),axis=0,return_inverse=True,return_counts=True)
+    return edges[counts[inverse.reshape(-1)]==1]
+
+
+def solidify(
+     vertices:numpy.ndarray
+    ,triangles:numpy.ndarray
+    ,thickness:float
+)->Tuple[numpy.ndarray,numpy.ndarray]:
+    """
+    Close an open surface into a shell by offsetting it along its vertex normals
+    and stitching the boundary edges of both sheets together.
+
+    For V vertices, F triangles and B boundary edges the result always has
+    2V vertices and 2F+2B consistently oriented triangles.
+
+    Returns:
+        Solid vertices (2V,3) and triangles (2F+2B,3)
+    """
+    vertices=numpy.asarray(vertices,dtype=numpy.float64).reshape(-1,3)
+    triangles=numpy.asarray(triangles,dtype=numpy.int64).reshape(-1,3)
+    n=len(vertices)
+
+    offset=vertices+thickness*vertex_normals(vertices,triangles)
+    edges=boundary_edges(triangles)
+    a,b=edges[:,0],edges[:,1]
+    walls=numpy.vstack([
+         numpy.stack([a,b,b+n],axis=1)
+        ,numpy.stack([a,b+n,a+n],axis=1)
+    ])
+    # The offset sheet faces away from the original one, so the original
+    # sheet is flipped to keep the shell outward oriented.
+    solid_triangles=numpy.vstack([triangles[:,::-1],triangles+n,walls])
+    if thickness < 0:
+        solid_triangles=solid_triangles[:,::-1]
+    debug(f"solidify: vertices={2*n}, triangles={len(solid_triangles)}, boundary_edges={len(edges)}")
+    return numpy.vstack([vertices,offset]),solid_triangles
+
+
+# Outward faces of a positively oriented tetrahedron (0,1,2,3)
+_TETRAHEDRON_FACES=numpy.array([[1,2,3],[0,3,2],[0,1,3],[0,2,1]])
+
+def boundary_faces(vertices:numpy.ndarray,tetrahedrons:numpy.ndarray)->Tuple[numpy.ndarray,numpy.ndarray]:
+    """
+    Extract the exterior triangles of a tetrahedral mesh by hashing all
+    tetrahedron faces and keeping those used by a single tetrahedron.
+
+    Returns:
+        Outward oriented (m,3) triangles and the tetrahedron each belongs to
+    """
+    vertices=numpy.asarray(vertices,dtype=numpy.float64).reshape(-1,3)
+    tetrahedrons=numpy.asarray(tetrahedrons,dtype=numpy.int64).reshape(-1,4)
+    v=vertices[tetrahedrons]
+    volume=numpy.einsum('ij,ij->i',numpy.cross(v[:,1]-v[:,0],v[:,2]-v[:,0]),v[:,3]-v[:,0])
+    faces=tetrahedrons[:,_TETRAHEDRON_FACES]
+    faces[volume<0]=faces[volume<0][:,:,::-1]
+    faces=faces.reshape(-1,3)
+    _,inverse,counts=numpy.unique(numpy.sort(faces,axis=1),axis=0,return_inverse=True,return_counts=True)
+    is_boundary=counts[inverse.reshape(-1)]==1
+    return faces[is_boundary],numpy.nonzero(is_boundary)[0]//4
+
+
+def compact(vertices:numpy.ndarray,faces:numpy.ndarray)->Tuple[numpy.ndarray,numpy.ndarray,numpy.ndarray]:
+    """
+    Drop vertices not referenced by any face.
+
+    Returns:
+        Used vertices, reindexed faces and the original index of every used vertex
+    """
+    used,inverse=numpy.unique(faces,return_inverse=True)
+    return numpy.asarray(vertices).reshape(-1,3)[used],inverse.reshape(faces.shape),used
+
+
+def cluster_mean(values:numpy.ndarray,vertex_map:numpy.ndarray,cluster_cn:int)->numpy.ndarray:
+    """
+    Average per vertex values over the clusters given by vertex_map.
+    """
+    values=numpy.asarray(values,dtype=numpy.float64)
+    sums=numpy.zeros((cluster_cn,)+values.shape[1:])
+    numpy.add.at(sums,vertex_map,values)
+    counts=numpy.bincount(vertex_map,minlength=cluster_cn).reshape((-1,)+(1,)*(values.ndim-1))
+    return sums/counts
+
+
+def cluster_decimate(
+     vertices:numpy.ndarray
+    ,triangles:numpy.ndarray
+    ,grid:int
+)->Tuple[numpy.ndarray,numpy.ndarray,numpy.ndarray,numpy.ndarray]:
+    """
+    Decimate a triangle mesh by vertex clustering on a uniform grid with
+    `grid` cells along its longest axis. Triangles collapsed onto fewer than
+    three clusters and duplicates are dropped.
+
+    Returns:
+        Cluster vertices, triangles, the cluster of every input vertex and the
+        input index of every kept triangle
+    """
+    vertices=numpy.asarray(vertices,dtype=numpy.float64).reshape(-1,3)
+    triangles=numpy.asarray(triangles,dtype=numpy.int64).reshape(-1,3)
+    vmin=vertices.min(axis=0)
+    cell_size=(vertices.max(axis=0)-vmin).max()/grid
+    if cell_size==0:
+        cell_size=1.0
+    # Vertices on the max face of the longest axis belong to the last cell
+    keys=numpy.minimum(numpy.floor((vertices-vmin)/cell_size).astype(numpy.int64),grid-1)
+    _,vertex_map=numpy.unique(keys,axis=0,return_inverse=True)
+    vertex_map=vertex_map.reshape(-1)
+    cluster_cn=int(vertex_map.max())+1
+    clustered=vertex_map[triangles]
+    is_valid=(clustered[:,0]!=clustered[:,1]) & (clustered[:,1]!=clustered[:,2]) & (clustered[:,2]!=clustered[:,0])
+    kept=numpy.nonzero(is_valid)[0]
+    _,first=numpy.unique(numpy.sort(clustered[kept],axis=1),axis=0,return_index=True)
+    kept=kept[numpy.sort(first)]
+    debug(f"cluster_decimate: vertices {len(vertices)}->{cluster_cn}, triangles {len(triangles)}->{len(kept)}")
+    return cluster_mean(vertices,vertex_map,cluster_cn),clustered[kept],vertex_map,kept
+
+
+@dataclass
+class MeshCleanReport:
+    input_vertices:int
+    output_vertices:int
+    welded_vertices:int
+    unreferenced_vertices:int
+    input_faces:int
+    output_faces:int
+    degenerate_faces:int
+    duplicate_faces:int
+
+
+def _weld(vertices:numpy.ndarray,tolerance:float)->numpy.ndarray:
+    """
+    Map every vertex to the first vertex of its connected component, where
+    vertices within `tolerance` of each other are connected.
+    """
+    pairs=KDTree(vertices).query_pairs(tolerance,output_type='ndarray')
+    graph=coo_matrix((numpy.ones(len(pairs)),(pairs[:,0],pairs[:,1])),shape=(len(vertices),)*2)
+    _,labels=connected_components(graph,directed=False)
+    _,first,inverse=numpy.unique(labels,return_index=True,return_inverse=True)
+    return first[inverse.reshape(-1)]
+
+
+def clean_mesh(
+     vertices:numpy.ndarray
+    ,triangles:numpy.ndarray
+    ,tolerance:float
+)->Tuple[numpy.ndarray,numpy.ndarray,numpy.ndarray,numpy.ndarray,MeshCleanReport]:
+    """
+    Weld vertices within `tolerance` of each other, drop degenerate and
+    duplicate triangles and remove vertices no longer referenced. Welding is
+    transitive, so a chain of close vertices collapses to one. Welded vertices
+    keep the coordinates of their first occurrence.
+
+    Returns:
+        Clean vertices and triangles, the clean index of every input vertex
+        (-1 if removed), the input index of every kept triangle and a report
+    """
+    vertices=numpy.asarray(vertices,dtype=numpy.float64).reshape(-1,3)
+    triangles=numpy.asarray(triangles,dtype=numpy.int64).reshape(-1,3)
+    representative=_weld(vertices,tolerance)
+    welded=representative[triangles]
+
+    v=vertices[welded]
+    doubled_area=numpy.linalg.norm(numpy.cross(v[:,1]-v[:,0],v[:,2]-v[:,0]),axis=1)
+    longest_edge=numpy.max(numpy.linalg.norm(v-v[:,[1,2,0]],axis=2),axis=1)
+    is_degenerate=(welded[:,0]==welded[:,1]) | (welded[:,1]==welded[:,2]) | (welded[:,2]==welded[:,0]) \
+        | (doubled_area <= numpy.finfo(numpy.float64).eps*longest_edge**2)
+    face_map=numpy.nonzero(~is_degenerate)[0]
+    _,first=numpy.unique(numpy.sort(welded[face_map],axis=1),axis=0,return_index=True)
+    duplicate_cn=len(face_map)-len(first)
+    face_map=face_map[numpy.sort(first)]
+
+    used,inverse=numpy.unique(welded[face_map],return_inverse=True)
+    used_map=numpy.full(len(vertices),-1,dtype=numpy.int64)
+    used_map[used]=numpy.arange(len(used))
+    vertex_map=used_map[representative]
+
+    report=MeshCleanReport(
+        input_vertices=len(vertices)
+        ,output_vertices=len(used)
+        ,welded_vertices=int((representative!=numpy.arange(len(vertices))).sum())
+        ,unreferenced_vertices=int(((vertex_map==-1) & (representative==numpy.arange(len(vertices)))).sum())
+        ,input_faces=len(triangles)
+        ,output_faces=len(face_map)
+        ,degenerate_faces=int(is_degenerate.sum())
+        ,duplicate_faces=duplicate_cn
+    )
+    debug(f"clean_mesh: {report}")
+    return vertices[used],inverse.reshape(-1,3),vertex_map,face_map,report
@@ -4,7 +4,7 @@ import pyvista
 import tetgen
 import vtk
 from scipy.spatial import KDTree
-from typing import List,Tuple,Union,Iterable
+from typing import List,Optional,Tuple,Union,Iterable
 from pydantic import BaseModel,validator,ValidationError,conlist,conint,root_validator,confloat,constr
 
 
@@ -98,6 +98,12 @@ class AnalysisRequest(BaseModel):
     poisson_ratio:confloat(ge=0.0,le=1.0)
     load_constraints:conlist(LoadConstraint,min_items=1)
     fixed_constraints:conlist(FixedConstraint,min_items=1)
+    # 'volume' returns every tetrahedron, 'surface' only the exterior faces
+    result_view:constr(regex="^(volume|surface)$")="volume"
+    # Cells along the longest axis for preview decimation of the surface view
+    surface_decimation_grid:Optional[conint(ge=2)]=None
+    # Vertices closer than this fraction of the bounding box diagonal are welded
+    weld_tolerance:confloat(ge=0.0)=1e-6
     @validator('vertices',allow_reuse=True)
     def validate_vertices_modulus(cls,v):
         assert len(v) % 3 == 0, "Vertex list length is not a multiple of 3."
@@ -108,6 +114,11 @@ class AnalysisRequest(BaseModel):
         faces = values.get('faces')
         assert len(faces) % stride == 0, "len(faces) is not a multiple of stride."
         return values
+    @root_validator(allow_reuse=True)
+    def validate_result_view(cls,values):
+        assert values.get('surface_decimation_grid') is None or values.get('result_view') == 'surface', \
+            "surface_decimation_grid requires result_view 'surface'."
+        return values
 
 
     def get_fixed_constraints(self)->Iterable[FixedConstraint]:
@@ -117,9 +128,11 @@ class AnalysisRequest(BaseModel):
         return self.load_constraints
 
 class AnalysisResponse(BaseModel):
+    # The surface and volume mesh fields are empty for the 'surface' result view
     surface_mesh_vertices:List[float]
     surface_mesh_face_stride:int
     surface_mesh_faces:list[int]
+    surface_mesh_vertex_map:List[int]=[] # Surface mesh index of every request vertex, -1 if removed
     
     volume_mesh_vertices:List[float]
     volume_mesh_tetrahedrons:List[int]
@@ -129,6 +142,13 @@ class AnalysisResponse(BaseModel):
     volume_mesh_node_cauchy_stress:List[float] # Per Node
     volume_mesh_node_principal_stress_vectors:List[float] # Per Node
 
+    # Only populated for the 'surface' result view
+    boundary_mesh_vertices:List[float]=[]
+    boundary_mesh_faces:List[int]=[] # Triangles
+    boundary_mesh_node_displacements:List[float]=[] # Per vertex
+    boundary_mesh_face_cauchy_strain:List[float]=[] # Per face, from the adjacent tetrahedron
+    boundary_mesh_face_cauchy_stress:List[float]=[] # Per face, from the adjacent tetrahedron
+    boundary_mesh_face_principal_stress_vectors:List[float]=[] # Per face, from the adjacent tetrahedron
 
 
     @root_validator(allow_reuse=True)
@@ -155,10 +175,40 @@ class AnalysisResponse(BaseModel):
         pstress=values.get('volume_mesh_node_principal_stress_vectors')
         assert len(pstress) == node_cn*9,"principal stress vector length must be 9 times the node count."
 
+        bm_verts=values.get('boundary_mesh_vertices')
+        assert len(bm_verts) % 3 ==0,'boundary mesh vertices must be multiple of 3.'
+        bm_faces=values.get('boundary_mesh_faces')
+        assert len(bm_faces) % 3 ==0,'boundary mesh faces must be multiple of 3.'
+        face_cn=len(bm_faces)/3
+        assert len(values.get('boundary_mesh_node_displacements')) == len(bm_verts),"boundary displacement length must exactly equal boundary vertex count"
+        assert len(values.get('boundary_mesh_face_cauchy_stress')) == face_cn*6,"boundary cauchy stress length must be 6 times the face count."
+        assert len(values.get('boundary_mesh_face_cauchy_strain')) == face_cn*6,"boundary cauchy strain length must be 6 times the face count."
+        assert len(values.get('boundary_mesh_face_principal_stress_vectors')) == face_cn*9,"boundary principal stress vector length must be 9 times the face count."
+
         return values
 
     def save(self,filename_wo_suffix):
 
+        if len(self.boundary_mesh_faces) > 0:
+            pv=pyvista.PolyData(
+                numpy.array(self.boundary_mesh_vertices).reshape(-1,3)
+                ,faces=numpy.hstack([
+                    numpy.full((len(self.boundary_mesh_faces)//3,1),3)
+                    ,numpy.array(self.boundary_mesh_faces).reshape(-1,3)
+                ]).flatten()
+            )
+            pv.cell_data["cauchy-stress"]=numpy.array(self.boundary_mesh_face_cauchy_stress).reshape(-1,6)
+            pv.cell_data["cauchy-strain"]=numpy.array(self.boundary_mesh_face_cauchy_strain).reshape(-1,6)
+            psv=numpy.array(self.boundary_mesh_face_principal_stress_vectors).reshape(-1,3,3)
+            pv.cell_data["principal_stress_vector_1"]=psv[:,0]
+            pv.cell_data["principal_stress_vector_2"]=psv[:,1]
+            pv.cell_data["principal_stress_vector_3"]=psv[:,2]
+            pv.point_data["displacement"]=numpy.array(self.boundary_mesh_node_displacements).reshape(-1,3)
+            pv.save(filename_wo_suffix+".surface.vtk")
+
+        if len(self.volume_mesh_tetrahedrons) == 0:
+            return
+
         pv=pyvista.UnstructuredGrid(
             {vtk.VTK_TETRA:numpy.array(self.volume_mesh_tetrahedrons).reshape(-1,4)}
             ,numpy.array(self.volume_mesh_vertices).reshape(-1,3)
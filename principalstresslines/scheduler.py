@@ -0,0 +1,240 @@
+import os
+import logging
+import numpy
+from concurrent.futures import BrokenExecutor, Executor, Future, FIRST_COMPLETED, wait
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits=None
+
+logger= logging.getLogger()
+debug,info,warn = logger.debug,logger.info,logger.warn
+
+
+# Calibrated on the sphere benchmark (7k-33k DOFs, P2 field, SymmetricSuperLU):
+# ~70 matrix nonzeros per DOF row and LU factors growing as 9*dofs^1.43
+# nonzeros, stored at ~12 bytes per nonzero.
+NONZEROS_PER_DOF=70
+FACTOR_COEFFICIENT=9.0
+FACTOR_EXPONENT=1.43
+BYTES_PER_NONZERO=12
+# Resident size of a worker with sfepy loaded before solving, charged once
+# per pool worker rather than per job
+WORKER_OVERHEAD_BYTES=256*1024**2
+# Peak growth of a worker while reading, cleaning and tetrahedralizing a mesh,
+# measured on the sphere benchmark as ~90 bytes per input file byte
+PREPARE_BYTES_PER_INPUT_BYTE=100
+
+
+@dataclass
+class JobEstimate:
+    vertices:int
+    tetrahedrons:int
+    dofs:int
+    nonzeros:int
+    factor_nonzeros:int
+    memory_bytes:int
+
+
+def estimate_job(vertices:numpy.ndarray,tetrahedrons:numpy.ndarray,approx_order:int=2)->JobEstimate:
+    """
+    Estimate the size of the linear elasticity solve on a tetrahedral mesh.
+    """
+    vertex_cn=len(vertices.flatten())//3
+    tetrahedrons=tetrahedrons.reshape(-1,4)
+    node_cn=vertex_cn
+    if approx_order >= 2:
+        edges=tetrahedrons[:,[[0,1],[0,2],[0,3],[1,2],[1,3],[2,3]]].reshape(-1,2)
+        node_cn+=len(numpy.unique(numpy.sort(edges,axis=1),axis=0))
+    dofs=3*node_cn
+    nonzeros=NONZEROS_PER_DOF*dofs
+    factor_nonzeros=int(FACTOR_COEFFICIENT*dofs**FACTOR_EXPONENT)
+    return JobEstimate(
+        vertices=vertex_cn
+        ,tetrahedrons=len(tetrahedrons)
+        ,dofs=dofs
+        ,nonzeros=nonzeros
+        ,factor_nonzeros=factor_nonzeros
+        ,memory_bytes=BYTES_PER_NONZERO*(nonzeros+factor_nonzeros)
+    )
+
+
+def estimate_prepare(input_bytes:int)->JobEstimate:
+    """
+    Estimate preparing a mesh file of `input_bytes`, which runs single threaded.
+    """
+    return JobEstimate(
+        vertices=0
+        ,tetrahedrons=0
+        ,dofs=0
+        ,nonzeros=0
+        ,factor_nonzeros=0
+        ,memory_bytes=PREPARE_BYTES_PER_INPUT_BYTE*input_bytes
+    )
+
+
+def available_cores()->int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory(fraction:float=.8)->int:
+    """
+    Memory available to this process tree, honoring container limits.
+    """
+    limit=os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    for cgroup_file in ('/sys/fs/cgroup/memory.max','/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(cgroup_file) as f:
+                value=f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():
+            limit=min(limit,int(value))
+        break
+    return int(limit*fraction)
+
+
+def run_with_thread_limit(threads:int,func:Callable,*args):
+    """
+    Call func with BLAS/OpenMP thread pools limited to `threads`.
+    """
+    if threadpool_limits is None:
+        return func(*args)
+    with threadpool_limits(limits=threads):
+        return func(*args)
+
+
+@dataclass
+class SchedulerJob:
+    key:Any
+    estimate:JobEstimate
+    func:Callable
+    args:tuple
+    # Set once the job was running when a worker died, to find the culprit
+    alone:bool=False
+
+
+class ResourceScheduler:
+    """
+    Admit solver jobs onto an executor against a core and memory budget.
+
+    The executor is expected to keep one resident worker per core, their
+    `worker_overhead_bytes` are charged once against `memory_bytes` and the
+    rest is shared by the running jobs. If the workers alone would exhaust the
+    budget fewer cores are used.
+
+    Jobs below `dofs_per_thread` run single threaded and are packed onto the
+    free cores, larger jobs get one thread per `dofs_per_thread` DOFs. Jobs
+    are admitted largest first while they fit; a job larger than the whole
+    budget runs alone.
+
+    A worker killed mid job (e.g. by the OOM killer) breaks the whole pool
+    and fails every job in it. The pool is rebuilt and those jobs are retried
+    one at a time, so only the job that breaks the pool alone fails.
+    """
+    def __init__(
+        self
+        ,cores:int=None
+        ,memory_bytes:int=None
+        ,dofs_per_thread:int=50000
+        ,worker_overhead_bytes:int=WORKER_OVERHEAD_BYTES
+    ):
+        self.cores=cores or available_cores()
+        memory_bytes=memory_bytes or available_memory()
+        if self.cores > 1 and self.cores*worker_overhead_bytes >= memory_bytes:
+            cores=max(1,memory_bytes//(2*worker_overhead_bytes))
+            warn(f"{self.cores} workers of {worker_overhead_bytes/1024**2:.0f}MB exceed the {memory_bytes/1024**2:.0f}MB budget, using {cores}.")
+            self.cores=cores
+        self.memory_bytes=max(0,memory_bytes-self.cores*worker_overhead_bytes)
+        self.dofs_per_thread=dofs_per_thread
+        self.pending:List[SchedulerJob]=[]
+        self.running:Dict[Future,Tuple[SchedulerJob,int,int]]={}
+        self.free_cores=self.cores
+        self.free_memory=self.memory_bytes
+        if threadpool_limits is None:
+            warn('threadpoolctl not installed, solver thread counts are not limited.')
+
+    def threads_for(self,estimate:JobEstimate)->int:
+        return int(min(self.cores,max(1,estimate.dofs//self.dofs_per_thread)))
+
+    def add(self,job:SchedulerJob):
+        self.pending.append(job)
+        self.pending.sort(key=lambda j:j.estimate.memory_bytes,reverse=True)
+
+    def admit(self,executor:Executor):
+        """
+        Submit the pending jobs that fit the free cores and memory.
+        """
+        for job in list(self.pending):
+            threads=self.threads_for(job.estimate)
+            memory=job.estimate.memory_bytes
+            if self.running and (job.alone or threads > self.free_cores or memory > self.free_memory):
+                continue
+            if memory > self.memory_bytes:
+                warn(f"{job.key}: estimated {memory/1024**2:.0f}MB exceeds the {self.memory_bytes/1024**2:.0f}MB budget, running alone.")
+            debug(f"{job.key}: admitted with {threads} threads, dofs={job.estimate.dofs}, memory={memory/1024**2:.0f}MB")
+            future=executor.submit(run_with_thread_limit,threads,job.func,*job.args)
+            self.running[future]=(job,threads,memory)
+            self.free_cores-=threads
+            self.free_memory-=memory
+            self.pending.remove(job)
+            if job.alone or memory > self.memory_bytes:
+                break
+
+    def release(self,future:Future)->SchedulerJob:
+        """
+        Return the resources of a completed job.
+        """
+        job,threads,memory=self.running.pop(future)
+        self.free_cores+=threads
+        self.free_memory+=memory
+        return job
+
+    def run(
+        self
+        ,executor_factory:Callable[[],Executor]
+        ,jobs:List[SchedulerJob]
+    )->Iterator[Tuple[SchedulerJob,Future]]:
+        """
+        Submit jobs as resources allow, yielding each job with its future as it
+        completes. Jobs added while iterating are scheduled as well.
+        """
+        for job in jobs:
+            self.add(job)
+        executor=executor_factory()
+        try:
+            while self.pending or self.running:
+                try:
+                    self.admit(executor)
+                except BrokenExecutor:
+                    # The running jobs fail with the pool and are handled below
+                    if not self.running:
+                        executor.shutdown(wait=False)
+                        executor=executor_factory()
+                        continue
+                done,_=wait(self.running,return_when=FIRST_COMPLETED)
+                if any(_is_broken(f) for f in done):
+                    # A broken pool fails every job submitted to it
+                    done,_=wait(self.running)
+                    executor.shutdown(wait=False)
+                    executor=executor_factory()
+                broken=[f for f in done if _is_broken(f)]
+                for future in done:
+                    job=self.release(future)
+                    if len(broken) > 1 and future in broken:
+                        warn(f"{job.key}: worker pool broke while running {len(broken)} jobs, retrying alone.")
+                        self.add(replace(job,alone=True))
+                        continue
+                    yield job,future
+        finally:
+            executor.shutdown(wait=True)
+
+
+def _is_broken(future:Future)->bool:
+    return isinstance(future.exception(),BrokenExecutor)
@@ -1,19 +1,37 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from aiohttp import web,request,web_response
+from pydantic import ValidationError
+
+from .analysis import analyze_cached
+from .model import AnalysisRequest
 
 
 routes = web.RouteTableDef()
 
+# Each solve factorizes its own system with multithreaded BLAS, so only a
+# few run at once; the rest queue here instead of oversubscribing the cores.
+MAX_CONCURRENT_SOLVES=2
+solve_executor=ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SOLVES,thread_name_prefix='analyze')
+
 @routes.get('/health')
 async def health(request:web.Request):
     return web.Response(status=200)
 
 @routes.get('/analyze')
-async def health(request:web.Request):
-    json=request.json()
-    return web.Response(status=200)
+async def analyze(request:web.Request):
+    try:
+        rqst=AnalysisRequest.parse_obj(await request.json())
+    except ValidationError as e:
+        return web.Response(status=400,text=e.json(),content_type='application/json')
+    # Solves are blocking, run them off the event loop so identical
+    # concurrent requests can coalesce in the analysis cache.
+    loop=asyncio.get_running_loop()
+    rsp=await loop.run_in_executor(solve_executor,analyze_cached,rqst)
+    return web.Response(status=200,text=rsp.json(),content_type='application/json')
 
 
 def run_server():
     app = web.Application()
     app.add_routes(routes)
-    web.run_app(app,port=2002)
\ No newline at end of file
+    web.run_app(app,port=2002)
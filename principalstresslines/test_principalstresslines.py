@@ -1,13 +1,32 @@
 from genericpath import isfile
+import tempfile
+import logging
+import threading
+import time
 import unittest
+import unittest.mock
+import numpy
 import os
 import pathlib
 import pyvista
 
 from principalstresslines.convert import sfepy_from_file
-from principalstresslines.analysis import analyze
-from principalstresslines.model import AnalysisRequest, BoxConstraintRegion, FixedConstraint, LoadConstraint, SphereConstraintRegion, VertexConstraintRegion
+from principalstresslines.analysis import analyze, surface_view, tetrahedralize
+from principalstresslines.batch import collect_inputs, output_stem, request_from_file, run_batch
+from principalstresslines.cache import BYTES_PER_LIST_ITEM, AnalysisCache, request_hash, response_size
+from principalstresslines.meshtools import boundary_faces, clean_mesh, cluster_decimate, solidify, triangles_to_faces
+from principalstresslines.model import AnalysisRequest, AnalysisResponse, BoxConstraintRegion, FixedConstraint, LoadConstraint, SphereConstraintRegion, VertexConstraintRegion
 from principalstresslines.materials import Concrete,Wood
+from pydantic import ValidationError
+from principalstresslines.stress import compute_stress
+from sfepy.solvers.ls import ScipyDirect
+from principalstresslines.scheduler import JobEstimate, ResourceScheduler, SchedulerJob, estimate_job, run_with_thread_limit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+try:
+    from threadpoolctl import threadpool_info
+except ImportError:
+    threadpool_info=None
 
 class TestSuiteTestCase(unittest.TestCase):
     def test_testsuite(self):
@@ -144,4 +163,399 @@ class TestSolver(unittest.TestCase):
                 mesh=sfepy_from_file(file)
                 outpath=pathlib.Path('/app/testdata/output').joinpath(file.stem).with_suffix('.vtk')
                 solve(mesh,outfile=str(outpath))
-    '''
\ No newline at end of file
+    '''
+
+
+def _box_request(load_constraints=None,fixed_constraints=None):
+    s=pyvista.Cube(center=(0,0,.5)).triangulate()
+    return AnalysisRequest(
+         vertices=s.points.flatten().tolist()
+         ,face_stride=int(len(s.faces)/s.n_faces)
+         ,faces=s.faces.flatten().tolist()
+         ,young_modulus=Wood.young_modulus_mpa
+         ,poisson_ratio=Wood.poisson_ratio
+         ,load_constraints=load_constraints or [
+            LoadConstraint(
+                regions=[
+                    BoxConstraintRegion(type="box",min=[-1,-1,.9],max=[1,1,1])
+                    ,SphereConstraintRegion(type="sphere",origin=[0,0,1],radius=.1)
+                ]
+                ,load_vector=[0,0,-100]
+                ,is_constant=True
+            )
+         ]
+         ,fixed_constraints=fixed_constraints or [
+            FixedConstraint(regions=[BoxConstraintRegion(type="box",min=[-1,-1,0],max=[1,1,.1])])
+         ]
+    )
+
+
+class TestAnalysisCache(unittest.TestCase):
+
+    def test_hash_ignores_constraint_order(self):
+        a=_box_request()
+        b=_box_request()
+        b.load_constraints[0].regions.reverse()
+        self.assertEqual(request_hash(a),request_hash(b))
+        b.load_constraints[0].load_vector=[0,0,-200]
+        self.assertNotEqual(request_hash(a),request_hash(b))
+
+    def test_hash_includes_options(self):
+        a=_box_request()
+        for field,value in [('result_view','surface'),('weld_tolerance',1e-3),('poisson_ratio',.2)]:
+            b=_box_request()
+            setattr(b,field,value)
+            self.assertNotEqual(request_hash(a),request_hash(b),field)
+
+    def test_eviction(self):
+        # Results are their own size in bytes
+        cache=AnalysisCache(max_bytes=5,sizeof=lambda r:r)
+        a=_box_request()
+        b=_box_request()
+        b.young_modulus+=1
+        c=_box_request()
+        c.young_modulus+=2
+        calls=[]
+        compute=lambda r:calls.append(r) or len(calls)+1
+        self.assertEqual(cache.get_or_compute(a,compute),2)
+        self.assertEqual(cache.get_or_compute(a,compute),2)
+        self.assertEqual(cache.get_or_compute(b,compute),3)
+        self.assertEqual(cache.size_bytes,5)
+        # Evicts least recently used entries until c fits
+        self.assertEqual(cache.get_or_compute(c,compute),4)
+        self.assertEqual(cache.size_bytes,4)
+        self.assertEqual(len(cache),1)
+        self.assertEqual(cache.get_or_compute(c,compute),4)
+        self.assertEqual(cache.get_or_compute(b,compute),5)
+        self.assertEqual(cache.size_bytes,5)
+        self.assertEqual(cache.hits,2)
+        # Larger than the whole cache, returned but not cached
+        big=_box_request()
+        big.young_modulus+=3
+        self.assertEqual(cache.get_or_compute(big,lambda r:6),6)
+        self.assertEqual(cache.size_bytes,5)
+
+    def test_response_size(self):
+        rsp=AnalysisResponse(
+            surface_mesh_vertices=[0.0]*9
+            ,surface_mesh_face_stride=4
+            ,surface_mesh_faces=[3,0,1,2]
+            ,volume_mesh_vertices=[]
+            ,volume_mesh_tetrahedrons=[]
+            ,volume_mesh_node_displacements=[]
+            ,volume_mesh_node_cauchy_strain=[]
+            ,volume_mesh_node_cauchy_stress=[]
+            ,volume_mesh_node_principal_stress_vectors=[]
+        )
+        self.assertEqual(response_size(rsp),13*BYTES_PER_LIST_ITEM)
+
+    def test_coalesce_inflight(self):
+        cache=AnalysisCache(sizeof=len)
+        rqst=_box_request()
+        release=threading.Event()
+        calls=[]
+        def compute(r):
+            calls.append(r)
+            release.wait(5)
+            return 'result'
+        results=[]
+        threads=[threading.Thread(target=lambda:results.append(cache.get_or_compute(rqst,compute))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        deadline=time.monotonic()+5
+        while cache.misses+cache.coalesced < 4:
+            if time.monotonic() > deadline:
+                release.set()
+                self.fail('requests did not reach the cache in time')
+            time.sleep(.01)
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual(len(calls),1)
+        self.assertEqual(results,['result']*4)
+        self.assertEqual(cache.coalesced,3)
+
+
+class TestSolidify(unittest.TestCase):
+
+    def test_solidify_open_inputs(self):
+        inputs=sorted(pathlib.Path(__file__).parent.parent.joinpath('testdata','input').glob('*.obj'))
+        self.assertGreater(len(inputs),0)
+        for file in inputs:
+            s=pyvista.get_reader(str(file)).read().triangulate()
+            triangles=s.faces.reshape(-1,4)[:,1:]
+            # Open the input by dropping its upper half
+            keep=s.points[triangles].mean(axis=1)[:,2] < numpy.median(s.points[:,2])
+            triangles=triangles[keep]
+            opened=pyvista.PolyData(s.points,faces=triangles_to_faces(triangles))
+            self.assertFalse(opened.is_manifold)
+
+            start=time.perf_counter()
+            opened.extrude([0,0,.1],capping=True) \
+                .clip_closed_surface(normal=[0,0,1],tolerance=.0001) \
+                .fill_holes(1000) \
+                .triangulate() \
+                .compute_normals(auto_orient_normals=True)
+            legacy_time=time.perf_counter()-start
+
+            start=time.perf_counter()
+            vertices,solid_triangles=solidify(s.points,triangles,.1)
+            solid=pyvista.PolyData(vertices,faces=triangles_to_faces(solid_triangles))
+            solidify_time=time.perf_counter()-start
+            logging.getLogger().debug(f"{file.name}: extrude/clip/fill_holes={legacy_time:.4f}s solidify={solidify_time:.4f}s")
+
+            self.assertTrue(solid.is_manifold)
+            self.assertEqual(solid.n_points,2*s.n_points)
+            self.assertEqual(solid.n_open_edges,0)
+            self.assertGreater(solid.volume,0)
+
+
+class TestSymmetricSuperLU(unittest.TestCase):
+
+    def test_solve_matches_default_solver(self):
+        s=pyvista.Sphere(radius=2.5,center=(0,0,2.5),theta_resolution=20,phi_resolution=20)
+        rqst=_box_request(
+            load_constraints=[LoadConstraint(
+                regions=[BoxConstraintRegion(type="box",min=[-999,-999,4],max=[999,999,5])]
+                ,load_vector=[0,0,-25000]
+                ,is_constant=False
+            )]
+            ,fixed_constraints=[FixedConstraint(
+                regions=[BoxConstraintRegion(type="box",min=[-999,-999,0],max=[999,999,1])]
+            )]
+        )
+        vertices,tetrahedrons=tetrahedralize(s)
+        symmetric=compute_stress('symmetric',vertices,tetrahedrons,rqst)
+        with unittest.mock.patch('principalstresslines.stress.SymmetricSuperLU',ScipyDirect):
+            default=compute_stress('default',vertices,tetrahedrons,rqst)
+        for expected,actual in zip(default,symmetric):
+            numpy.testing.assert_allclose(actual,expected,rtol=1e-6,atol=1e-9*abs(expected).max())
+
+
+class TestSurfaceView(unittest.TestCase):
+
+    def test_boundary_faces(self):
+        vertices,tetrahedrons=tetrahedralize(pyvista.Sphere(radius=2.5,center=(0,0,2.5)))
+        vertices=vertices.reshape(-1,3)
+        faces,cells=boundary_faces(vertices,tetrahedrons)
+        self.assertEqual(len(faces),len(cells))
+        self.assertTrue(numpy.all(cells < len(tetrahedrons)//4))
+        surface=pyvista.PolyData(vertices,faces=triangles_to_faces(faces))
+        self.assertTrue(surface.is_manifold)
+        # Outward orientation gives a positive signed volume
+        v=vertices[faces]
+        signed_volume=numpy.einsum('ij,ij->i',v[:,0],numpy.cross(v[:,1],v[:,2])).sum()/6
+        self.assertAlmostEqual(signed_volume,surface.volume,places=6)
+
+    def test_cluster_decimate(self):
+        s=pyvista.Sphere(radius=2.5)
+        triangles=s.faces.reshape(-1,4)[:,1:]
+        vertices,faces,vertex_map,kept=cluster_decimate(s.points,triangles,8)
+        self.assertLess(len(faces),len(triangles))
+        self.assertEqual(len(vertex_map),s.n_points)
+        numpy.testing.assert_array_equal(faces,vertex_map[triangles[kept]])
+        self.assertTrue(numpy.all(faces[:,0]!=faces[:,1]))
+        # At most grid cells along every axis
+        _,_,vertex_map,_=cluster_decimate(s.points,triangles,2)
+        self.assertLessEqual(vertex_map.max()+1,8)
+
+    def test_decimation_keeps_collapsed_boundary(self):
+        # A needle whose far corners share one cell at grid 2
+        vertices=numpy.array([[0,0,0],[1,0,0],[1,.01,0],[1,0,.01]],dtype=numpy.float64)
+        tetrahedrons=numpy.array([0,1,2,3])
+        view=surface_view(vertices,tetrahedrons,numpy.zeros((4,3)),numpy.zeros((1,6)),numpy.zeros((1,6)),2)
+        self.assertEqual(len(view['boundary_mesh_faces']),4*3)
+        self.assertEqual(len(view['boundary_mesh_vertices']),4*3)
+
+    def test_surface_view_payload(self):
+        s=pyvista.Sphere(radius=2.5,center=(0,0,2.5))
+        rqst=_box_request(
+            load_constraints=[LoadConstraint(
+                regions=[BoxConstraintRegion(type="box",min=[-999,-999,4],max=[999,999,5])]
+                ,load_vector=[0,0,-25000]
+                ,is_constant=False
+            )]
+            ,fixed_constraints=[FixedConstraint(
+                regions=[BoxConstraintRegion(type="box",min=[-999,-999,0],max=[999,999,1])]
+            )]
+        )
+        rqst=AnalysisRequest.parse_obj({
+            **rqst.dict()
+            ,'vertices':s.points.flatten().tolist()
+            ,'faces':s.faces.tolist()
+            ,'result_view':'surface'
+        })
+        full=analyze(rqst)
+        self.assertEqual(full.surface_mesh_vertices,[])
+        self.assertEqual(full.volume_mesh_tetrahedrons,[])
+        rqst.surface_decimation_grid=4
+        preview=analyze(rqst)
+        self.assertGreater(len(preview.boundary_mesh_faces),0)
+        self.assertLess(len(preview.json()),len(full.json())/4)
+
+    def test_save_surface(self):
+        vertices,tetrahedrons=tetrahedralize(pyvista.Sphere(radius=2.5,center=(0,0,2.5)))
+        cell_cn=len(tetrahedrons)//4
+        strain=numpy.random.default_rng(0).uniform(size=(cell_cn,6))
+        rsp=AnalysisResponse(
+            surface_mesh_vertices=[]
+            ,surface_mesh_face_stride=4
+            ,surface_mesh_faces=[]
+            ,volume_mesh_vertices=[]
+            ,volume_mesh_tetrahedrons=[]
+            ,volume_mesh_node_displacements=[]
+            ,volume_mesh_node_cauchy_strain=[]
+            ,volume_mesh_node_cauchy_stress=[]
+            ,volume_mesh_node_principal_stress_vectors=[]
+            ,**surface_view(vertices.reshape(-1,3),tetrahedrons,numpy.zeros_like(vertices),numpy.zeros((cell_cn,6)),strain)
+        )
+        with tempfile.TemporaryDirectory() as output:
+            rsp.save(f"{output}/sphere")
+            saved=pyvista.read(f"{output}/sphere.surface.vtk")
+        numpy.testing.assert_allclose(saved.cell_data['cauchy-strain'].flatten(),rsp.boundary_mesh_face_cauchy_strain)
+
+    def test_decimation_validation(self):
+        with self.assertRaises(ValidationError):
+            AnalysisRequest.parse_obj({**_box_request().dict(),'result_view':'surface','surface_decimation_grid':1})
+        with self.assertRaises(ValidationError):
+            AnalysisRequest.parse_obj({**_box_request().dict(),'surface_decimation_grid':8})
+        rqst=AnalysisRequest.parse_obj({**_box_request().dict(),'result_view':'surface','surface_decimation_grid':2})
+        self.assertEqual(rqst.surface_decimation_grid,2)
+
+
+class TestBatch(unittest.TestCase):
+    spec={
+        'material':'Concrete'
+        ,'scale':1000
+        ,'load_constraints':[{
+            'regions':[{'type':'box','min':[-999999]*3,'max':[999999]*3}]
+            ,'load_vector':[0,0,-50*46000]
+            ,'is_constant':True
+        }]
+        ,'fixed_constraints':[{
+            'regions':[{'type':'box','min':[-999999]*3,'max':[999999,999999,1000]}]
+        }]
+    }
+
+    def test_request_from_file(self):
+        inputs=collect_inputs('/app/testdata/input/*.obj')
+        self.assertEqual(len(inputs),3)
+        rqst=request_from_file(inputs[0],self.spec)
+        self.assertEqual(rqst.young_modulus,Concrete.young_modulus_mpa)
+        self.assertEqual(rqst.face_stride,4)
+
+    def test_resume_skips_finished(self):
+        inputs=collect_inputs('/app/testdata/input')
+        with tempfile.TemporaryDirectory() as output:
+            output=pathlib.Path(output)
+            for f in inputs:
+                output.joinpath(f.name+'.npz').touch()
+            summary=run_batch(inputs,self.spec,output)
+            self.assertEqual([s['status'] for s in summary],['skipped']*len(inputs))
+            self.assertTrue(output.joinpath('summary.json').exists())
+
+    def test_output_names(self):
+        with tempfile.TemporaryDirectory() as input_dir:
+            input_dir=pathlib.Path(input_dir)
+            inputs=[input_dir.joinpath('part.obj'),input_dir.joinpath('part.vtk')]
+            output=input_dir.joinpath('output')
+            self.assertNotEqual(output_stem(output,inputs[0]),output_stem(output,inputs[1]))
+            with self.assertRaises(ValueError):
+                run_batch(inputs,self.spec,input_dir)
+
+
+def _sleep_and_return(value):
+    time.sleep(.2)
+    return value
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_estimate_job(self):
+        vertices,tetrahedrons=tetrahedralize(pyvista.Sphere(radius=2.5,center=(0,0,2.5)))
+        estimate=estimate_job(vertices,tetrahedrons)
+        self.assertEqual(estimate.tetrahedrons,len(tetrahedrons)//4)
+        self.assertGreater(estimate.dofs,3*estimate.vertices)
+        self.assertGreater(estimate.factor_nonzeros,estimate.nonzeros)
+
+    def test_memory_budget(self):
+        def estimate(dofs,memory):
+            return JobEstimate(vertices=0,tetrahedrons=0,dofs=dofs,nonzeros=0,factor_nonzeros=0,memory_bytes=memory)
+        lock=threading.Lock()
+        usage={'memory':0,'peak':0,'alone':True}
+        def job(memory):
+            with lock:
+                usage['memory']+=memory
+                usage['peak']=max(usage['peak'],usage['memory'])
+                if memory > 100 and usage['memory'] != memory:
+                    usage['alone']=False
+            time.sleep(.05)
+            with lock:
+                usage['memory']-=memory
+            return memory
+        scheduler=ResourceScheduler(cores=4,memory_bytes=100,dofs_per_thread=1000,worker_overhead_bytes=0)
+        jobs=[SchedulerJob(i,estimate(500,m),job,(m,)) for i,m in enumerate([10,20,30,40,60,150,5])]
+        self.assertEqual(scheduler.threads_for(estimate(500,0)),1)
+        self.assertEqual(scheduler.threads_for(estimate(2500,0)),2)
+        results=[future.result() for _,future in scheduler.run(lambda:ThreadPoolExecutor(max_workers=4),jobs)]
+        self.assertEqual(sorted(results),[5,10,20,30,40,60,150])
+        self.assertTrue(usage['alone'])
+        self.assertLessEqual(usage['peak'],150)
+
+    def test_worker_overhead(self):
+        scheduler=ResourceScheduler(cores=4,memory_bytes=1000,worker_overhead_bytes=100)
+        self.assertEqual(scheduler.memory_bytes,600)
+        scheduler=ResourceScheduler(cores=4,memory_bytes=300,worker_overhead_bytes=100)
+        self.assertEqual(scheduler.cores,1)
+        self.assertEqual(scheduler.memory_bytes,200)
+
+    def test_killed_worker(self):
+        scheduler=ResourceScheduler(cores=2,memory_bytes=100,worker_overhead_bytes=0)
+        estimate=JobEstimate(vertices=0,tetrahedrons=0,dofs=0,nonzeros=0,factor_nonzeros=0,memory_bytes=1)
+        jobs=[SchedulerJob('killed',estimate,os._exit,(1,))]+[SchedulerJob(i,estimate,_sleep_and_return,(i,)) for i in range(3)]
+        results={}
+        for job,future in scheduler.run(lambda:ProcessPoolExecutor(max_workers=2),jobs):
+            self.assertNotIn(job.key,results)
+            results[job.key]=future.exception() or future.result()
+        self.assertIsInstance(results.pop('killed'),BrokenProcessPool)
+        self.assertEqual(results,{0:0,1:1,2:2})
+
+    @unittest.skipIf(threadpool_info is None,'threadpoolctl not installed')
+    def test_thread_limit_in_worker(self):
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            libraries=pool.submit(run_with_thread_limit,3,threadpool_info).result()
+        self.assertGreater(len(libraries),0)
+        self.assertEqual({l['num_threads'] for l in libraries},{3})
+
+
+class TestCleanMesh(unittest.TestCase):
+
+    def test_clean_mesh(self):
+        s=pyvista.Sphere(radius=2.5)
+        triangles=s.faces.reshape(-1,4)[:,1:]
+        # Unshare every vertex, jitter below tolerance and add a degenerate and a duplicate face
+        vertices=s.points[triangles].reshape(-1,3)+numpy.random.default_rng(0).uniform(-1e-7,1e-7,(len(triangles)*3,3))
+        soup=numpy.arange(len(vertices)).reshape(-1,3)
+        soup=numpy.vstack([soup,[[0,0,1]],soup[:1,::-1]])
+        clean_vertices,clean_triangles,vertex_map,face_map,report=clean_mesh(vertices,soup,1e-4)
+        self.assertEqual(len(clean_vertices),s.n_points)
+        self.assertEqual(len(clean_triangles),len(triangles))
+        self.assertEqual(report.degenerate_faces,1)
+        self.assertEqual(report.duplicate_faces,1)
+        self.assertEqual(report.welded_vertices,len(vertices)-s.n_points)
+        self.assertTrue(pyvista.PolyData(clean_vertices,faces=triangles_to_faces(clean_triangles)).is_manifold)
+        numpy.testing.assert_allclose(clean_vertices[vertex_map],vertices,atol=1e-4)
+        numpy.testing.assert_array_equal(clean_triangles,vertex_map[soup[face_map]])
+
+    def test_weld_across_cell_boundaries(self):
+        # Pairs within tolerance straddling cell boundaries of tolerance sized
+        # grids, plus pairs just beyond tolerance
+        close=numpy.array([[0.9999,0.4999,0],[1.0001,0.5001,0],[5.0,5.0,4.6],[5.0,5.0,5.5]])*1e-3
+        far=numpy.array([[10.0,0,0],[11.1,0,0],[20.0,0,0],[20.6,0.6,0.6]])*1e-3
+        vertices=numpy.vstack([close,far])
+        triangles=numpy.array([[0,2,4],[1,3,5],[4,5,6],[6,7,0]])
+        _,_,vertex_map,_,report=clean_mesh(vertices,triangles,1e-3)
+        self.assertEqual(vertex_map[0],vertex_map[1])
+        self.assertEqual(vertex_map[2],vertex_map[3])
+        self.assertEqual(len(set(vertex_map[4:])),4)
+        self.assertEqual(report.welded_vertices,2)